@@ -1,167 +1,861 @@
-import streamlit as st
-import sqlite3
-import time
-import sacrebleu
-from datetime import datetime
-
-# Optional BERTScore import
-try:
-    from bert_score import score as bert_score
-    BERT_AVAILABLE = True
-except ImportError:
-    BERT_AVAILABLE = False
-
-# ============ DATABASE SETUP ============
-def init_db():
-    conn = sqlite3.connect("translations.db")
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS editing_exercises (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            source TEXT,
-            mt_output TEXT,
-            reference TEXT,
-            created_by TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS editing_submissions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            exercise_id INTEGER,
-            student_name TEXT,
-            student_edit TEXT,
-            time_spent REAL,
-            keystrokes INTEGER,
-            bleu REAL,
-            chrf REAL,
-            ter REAL,
-            bert_f1 REAL,
-            submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    conn.commit()
-    conn.close()
-
-init_db()
-
-# ============ UTILS ============
-def compute_scores(hypothesis, reference):
-    """Compute BLEU, chrF, TER, and optionally BERTScore."""
-    results = {}
-    if reference.strip():
-        results["BLEU"] = sacrebleu.corpus_bleu([hypothesis], [[reference]]).score
-        results["chrF"] = sacrebleu.corpus_chrf([hypothesis], [[reference]]).score
-        results["TER"] = sacrebleu.corpus_ter([hypothesis], [[reference]]).score
-    else:
-        results.update({"BLEU": None, "chrF": None, "TER": None})
-
-    if BERT_AVAILABLE and reference.strip():
-        try:
-            P, R, F1 = bert_score([hypothesis], [reference], lang="en", rescale_with_baseline=True)
-            results["BERT_F1"] = float(F1[0])
-        except:
-            results["BERT_F1"] = None
-    else:
-        results["BERT_F1"] = None
-
-    return results
-
-# ============ APP ============
-st.sidebar.title("Navigation")
-role = st.sidebar.selectbox("I am a", ["Student", "Instructor"])
-
-if role == "Instructor":
-    st.title("📚 Instructor Dashboard")
-    menu = st.sidebar.radio("Choose Action", ["Create Editing Exercise", "View Submissions"])
-
-    if menu == "Create Editing Exercise":
-        st.subheader("Create a New Editing Exercise")
-        source = st.text_area("Source Text")
-        mt_output = st.text_area("Machine Translation Output")
-        reference = st.text_area("Reference Translation (optional)")
-        instructor = st.text_input("Instructor Name")
-        if st.button("Save Exercise"):
-            conn = sqlite3.connect("translations.db")
-            c = conn.cursor()
-            c.execute("INSERT INTO editing_exercises (source, mt_output, reference, created_by) VALUES (?, ?, ?, ?)",
-                      (source, mt_output, reference, instructor))
-            conn.commit()
-            conn.close()
-            st.success("✅ Exercise created successfully!")
-
-    elif menu == "View Submissions":
-        st.subheader("Student Submissions")
-        conn = sqlite3.connect("translations.db")
-        c = conn.cursor()
-        c.execute("""
-            SELECT es.id, e.source, e.mt_output, e.reference, es.student_name,
-                   es.student_edit, es.bleu, es.chrf, es.ter, es.bert_f1,
-                   es.time_spent, es.keystrokes, es.submitted_at
-            FROM editing_submissions es
-            JOIN editing_exercises e ON es.exercise_id = e.id
-            ORDER BY es.submitted_at DESC
-        """)
-        rows = c.fetchall()
-        conn.close()
-
-        for r in rows:
-            st.markdown(f"""
-**Student:** {r[4]}  
-**Submitted At:** {r[12]}  
-**Source:** {r[1]}  
-**MT Output:** {r[2]}  
-**Student Edit:** {r[5]}  
-**Reference:** {r[3]}  
-
-📊 **Scores**  
-- BLEU: {r[6]}  
-- chrF: {r[7]}  
-- TER: {r[8]}  
-- BERT F1: {r[9]}  
-
-⌛ **Time Spent:** {r[10]} sec  
-⌨️ **Keystrokes:** {r[11]}  
-""")
-            st.markdown("---")
-
-elif role == "Student":
-    st.title("✍️ Student Editing Exercise")
-    student = st.text_input("Enter your name")
-    conn = sqlite3.connect("translations.db")
-    c = conn.cursor()
-    c.execute("SELECT id, source, mt_output, reference FROM editing_exercises ORDER BY created_at DESC")
-    exercises = c.fetchall()
-    conn.close()
-
-    if not exercises:
-        st.warning("⚠️ No exercises available yet. Please wait for your instructor.")
-    else:
-        choice = st.selectbox("Choose an Exercise", [f"Exercise {e[0]}" for e in exercises])
-        selected = exercises[int(choice.split()[1]) - 1]
-        st.markdown(f"**Source Text:** {selected[1]}")
-        st.markdown(f"**Machine Translation Output:** {selected[2]}")
-        reference = selected[3]
-
-        start_time = time.time()
-        student_edit = st.text_area("Edit the Translation Here ✍️", value=selected[2])
-        keystrokes = len(student_edit)
-
-        if st.button("Submit"):
-            end_time = time.time()
-            time_spent = round(end_time - start_time, 2)
-            scores = compute_scores(student_edit, reference or "")
-
-            conn = sqlite3.connect("translations.db")
-            c = conn.cursor()
-            c.execute("""
-                INSERT INTO editing_submissions (exercise_id, student_name, student_edit,
-                                                 time_spent, keystrokes, bleu, chrf, ter, bert_f1)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (selected[0], student, student_edit, time_spent, keystrokes,
-                  scores.get("BLEU"), scores.get("chrF"), scores.get("TER"), scores.get("BERT_F1")))
-            conn.commit()
-            conn.close()
-
-            st.success("✅ Submission saved and evaluated!")
-            st.json(scores)
+import streamlit as st
+import requests
+import csv
+import io
+import sqlite3
+import textwrap
+import time
+import functools
+import os
+import re
+import contextlib
+from collections import Counter
+from sacrebleu.metrics import BLEU, CHRF, TER
+import pandas as pd
+import numpy as np
+from datetime import datetime
+from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor
+
+# Optional torch import (shared by BERTScore, COMET and the sentence encoder)
+try:
+    import torch
+    torch.set_num_threads(min(8, os.cpu_count() or 1))
+    TORCH_AVAILABLE = True
+except ImportError:
+    TORCH_AVAILABLE = False
+
+# Optional BERTScore import
+try:
+    from bert_score import BERTScorer
+    BERT_AVAILABLE = TORCH_AVAILABLE
+except ImportError:
+    BERT_AVAILABLE = False
+
+# Optional RapidFuzz import (C++ bit-parallel edit distance)
+try:
+    from rapidfuzz.distance import Levenshtein as rf_levenshtein
+    from rapidfuzz import process as rf_process
+    RAPIDFUZZ_AVAILABLE = True
+except ImportError:
+    RAPIDFUZZ_AVAILABLE = False
+
+# Optional SentenceTransformer import (semantic similarity)
+try:
+    from sentence_transformers import SentenceTransformer
+    ST_AVAILABLE = True
+except ImportError:
+    ST_AVAILABLE = False
+
+# Optional COMET import
+try:
+    from comet import download_model, load_from_checkpoint
+    COMET_AVAILABLE = True
+except ImportError:
+    COMET_AVAILABLE = False
+
+# Optional pyahocorasick import (single-pass multi-pattern matching)
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+# ============ DATABASE SETUP ============
+_INSERT_EXERCISE = "INSERT INTO editing_exercises (source, mt_output, reference, idioms, created_by) VALUES (?, ?, ?, ?, ?)"
+_INSERT_SUBMISSION = """
+    INSERT INTO editing_submissions (exercise_id, student_name, student_edit,
+                                     time_spent, keystrokes, bleu, chrf, ter, bert_f1)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def init_db(conn):
+    c = conn.cursor()
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS editing_exercises (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT,
+            mt_output TEXT,
+            reference TEXT,
+            idioms TEXT,
+            created_by TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS editing_submissions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            exercise_id INTEGER,
+            student_name TEXT,
+            student_edit TEXT,
+            time_spent REAL,
+            keystrokes INTEGER,
+            bleu REAL,
+            chrf REAL,
+            ter REAL,
+            bert_f1 REAL,
+            comet REAL,
+            submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    try:
+        c.execute("ALTER TABLE editing_exercises ADD COLUMN idioms TEXT")
+    except sqlite3.OperationalError:
+        pass  # column already exists
+    try:
+        c.execute("ALTER TABLE editing_submissions ADD COLUMN comet REAL")
+    except sqlite3.OperationalError:
+        pass  # column already exists
+    c.execute("CREATE INDEX IF NOT EXISTS ix_submissions_student ON editing_submissions(student_name)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_submissions_exercise ON editing_submissions(exercise_id)")
+    conn.commit()
+
+@st.cache_resource
+def get_conn():
+    """One shared connection per process; WAL pragmas and schema setup run once here."""
+    conn = sqlite3.connect("translations.db", check_same_thread=False, cached_statements=512)
+    c = conn.cursor()
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute("PRAGMA synchronous=NORMAL")
+    c.execute("PRAGMA temp_store=MEMORY")
+    init_db(conn)
+    return conn
+
+def import_legacy_csv(path="student_activity.csv"):
+    """One-shot bulk load of the legacy CSV activity log into SQLite."""
+    if not os.path.exists(path):
+        return
+    conn = get_conn()
+    already = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name='legacy_activity'").fetchone()
+    if already is None:
+        with conn:
+            for chunk in pd.read_csv(path, chunksize=10_000):
+                chunk.to_sql("legacy_activity", conn, if_exists="append",
+                             index=False, method="multi", chunksize=1000)
+
+import_legacy_csv()
+
+def table_fingerprint(table):
+    """Cheap cache key: row count and max id change whenever the table changes."""
+    conn = get_conn()
+    fp = conn.execute(f"SELECT COUNT(*), IFNULL(MAX(id), 0) FROM {table}").fetchone()
+    return fp
+
+@st.cache_data
+def load_submissions(fingerprint):
+    conn = get_conn()
+    df = pd.read_sql_query("""
+        SELECT es.id, e.source, e.mt_output, e.reference, es.student_name,
+               es.student_edit, es.bleu, es.chrf, es.ter, es.bert_f1, es.comet,
+               es.time_spent, es.keystrokes, es.submitted_at
+        FROM editing_submissions es
+        JOIN editing_exercises e ON es.exercise_id = e.id
+        ORDER BY es.submitted_at DESC
+    """, conn)
+    df["submitted_at"] = (pd.to_datetime(df["submitted_at"], errors="coerce")
+                          .dt.strftime("%Y-%m-%d %H:%M:%S"))
+    return df
+
+@st.cache_data
+def load_leaderboard(fingerprint):
+    """Top-10 leaderboard aggregated inside SQLite over the student_name index."""
+    conn = get_conn()
+    return pd.read_sql_query("""
+        SELECT student_name AS Student, ROUND(SUM(IFNULL(bleu, 0)), 2) AS Points
+        FROM editing_submissions
+        GROUP BY student_name
+        ORDER BY Points DESC
+        LIMIT 10
+    """, conn)
+
+# ============ UTILS ============
+@functools.lru_cache(maxsize=256)
+def _idiom_list(idioms_str):
+    """Parse and lowercase an exercise's idiom string once per distinct value."""
+    return tuple(sorted({w.strip().lower() for w in idioms_str.split(",") if w.strip()}))
+
+@st.cache_resource
+def get_idiom_matcher(idioms_str):
+    """Build the multi-pattern matcher for an exercise's idiom list once."""
+    if AHOCORASICK_AVAILABLE:
+        automaton = ahocorasick.Automaton()
+        for idiom in _idiom_list(idioms_str):
+            automaton.add_word(idiom, idiom)
+        automaton.make_automaton()
+        return automaton
+    return _idiom_list(idioms_str)
+
+def check_idioms(text, idioms_str):
+    """Return (found, missing) idioms from the exercise list in one pass over the text."""
+    if not idioms_str or not idioms_str.strip():
+        return [], []
+    all_idioms = _idiom_list(idioms_str)
+    lowered = text.lower()
+    if AHOCORASICK_AVAILABLE:
+        found = {idiom for _, idiom in get_idiom_matcher(idioms_str).iter(lowered)}
+    else:
+        found = {idiom for idiom in all_idioms if idiom in lowered}
+    return [i for i in all_idioms if i in found], [i for i in all_idioms if i not in found]
+
+@st.cache_resource
+def get_bert_scorer(lang="en", rescale=True):
+    """Load the BERTScore model once per process; quantize to int8 when stuck on CPU."""
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    scorer = BERTScorer(lang=lang, rescale_with_baseline=rescale, device=device)
+    if device == "cuda":
+        scorer._model = scorer._model.half()
+    if device == "cpu":
+        try:
+            scorer._model = torch.quantization.quantize_dynamic(
+                scorer._model, {torch.nn.Linear}, dtype=torch.qint8)
+        except Exception:
+            pass
+    return scorer
+
+@st.cache_resource
+def get_semantic_model():
+    """Load the MiniLM sentence encoder once per process, preferring the ONNX runtime on CPU."""
+    model = None
+    if not (TORCH_AVAILABLE and torch.cuda.is_available()):
+        try:
+            # Needs the sentence-transformers[onnx] extra; int8 CPU inference.
+            model = SentenceTransformer("all-MiniLM-L6-v2", backend="onnx")
+        except Exception:
+            model = None
+    if model is None:
+        model = SentenceTransformer("all-MiniLM-L6-v2")
+        if TORCH_AVAILABLE and torch.cuda.is_available():
+            model = model.half()  # MiniLM is bandwidth-bound; fp16 halves the traffic
+    model.max_seq_length = 128  # translation exercises are short; skip pointless padding
+    return model
+
+@st.cache_resource
+def _emb_cache():
+    """Embedding cache shared by all sessions; cache_resource keeps it alive across reruns."""
+    return {}
+
+def encode_many(texts):
+    """Normalized MiniLM embeddings, encoding all cache misses in one padded batch."""
+    cache = _emb_cache()
+    missing = [t for t in dict.fromkeys(texts) if t not in cache]
+    if missing:
+        grad_free = torch.inference_mode() if TORCH_AVAILABLE else contextlib.nullcontext()
+        with grad_free:
+            embs = get_semantic_model().encode(missing, normalize_embeddings=True, batch_size=32)
+        for text, emb in zip(missing, embs):
+            cache[text] = emb
+        while len(cache) > 10_000:  # FIFO eviction past 10k texts
+            del cache[next(iter(cache))]
+    return [cache[t] for t in texts]
+
+def encode_cached(text):
+    """Normalized MiniLM embedding for a single text; repeats skip the forward pass."""
+    return encode_many([text])[0]
+
+def semantic_score(text_a, text_b):
+    """Cosine similarity between cached MiniLM embeddings, or None when unavailable."""
+    if not ST_AVAILABLE or not text_a.strip() or not text_b.strip():
+        return None
+    if text_a == text_b:
+        return 1.0  # identical text: cosine of a vector with itself, no forward pass needed
+    a, b = encode_many([text_a, text_b])
+    return float(np.dot(a, b))  # embeddings are pre-normalized, so dot == cosine
+
+def evaluate_with_semantic_cache(hypothesis, reference, tau=0.95):
+    """Reuse this session's scores when a new edit is semantically near-identical to an earlier one."""
+    if not ST_AVAILABLE:
+        return compute_scores(hypothesis, reference)
+    emb = np.asarray(encode_cached(hypothesis), dtype=np.float32)
+    cache = st.session_state.setdefault("sem_cache", [])
+    candidates = [(cached_emb, cached_scores) for ref, cached_emb, cached_scores in cache
+                  if ref == reference]
+    if candidates:
+        sims = np.stack([e for e, _ in candidates]) @ emb  # normalized, so dot == cosine
+        best = int(np.argmax(sims))
+        if float(sims[best]) >= tau:
+            return dict(candidates[best][1])
+    scores = compute_scores(hypothesis, reference)
+    cache.append((reference, emb, dict(scores)))
+    del cache[:-1024]
+    return scores
+
+def score_many(hyps, refs, batch_size=64):
+    """Batched BERTScore with OOM backoff: halve the batch size until the pass fits."""
+    scorer = get_bert_scorer()
+    while True:
+        try:
+            autocast = (torch.autocast("cuda", dtype=torch.float16)
+                        if torch.cuda.is_available() else contextlib.nullcontext())
+            with torch.inference_mode(), autocast:
+                return scorer.score(hyps, refs, batch_size=batch_size)
+        except RuntimeError:
+            if batch_size <= 1:
+                raise
+            batch_size //= 2
+
+@st.cache_resource
+def get_comet_model(name="wmt22-comet-da"):
+    """Download and deserialize the COMET checkpoint once per process; fp16 on GPU."""
+    model = load_from_checkpoint(download_model(name))
+    if TORCH_AVAILABLE and torch.cuda.is_available():
+        model = model.half()  # XLM-R regressor is tensor-core friendly at fp16
+    return model
+
+def comet_scores(sources, hypotheses, references):
+    """COMET scores for aligned source/hypothesis/reference lists, or None when unavailable."""
+    if not COMET_AVAILABLE:
+        return None
+    try:
+        use_gpu = TORCH_AVAILABLE and torch.cuda.is_available()
+        data = [{"src": s, "mt": h, "ref": r}
+                for s, h, r in zip(sources, hypotheses, references)]
+        return get_comet_model().predict(data, batch_size=32 if use_gpu else 8,
+                                         gpus=1 if use_gpu else 0).scores
+    except Exception:
+        return None
+
+_HF_API_BASE = "https://api-inference.huggingface.co/models"
+
+@st.cache_resource
+def get_http_session():
+    """Shared keep-alive session: one TLS handshake amortized across all API calls."""
+    session = requests.Session()
+    # Sized to keep a connection warm for every concurrent translate_long_text worker.
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16))
+    token = os.environ.get("HF_TOKEN", "")
+    if token:
+        session.headers.update({"Authorization": f"Bearer {token}"})
+    return session
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def translate_text(text, src_lang="en", tgt_lang="ar"):
+    """Machine-translate via the HF Inference API, memoized for an hour per distinct input."""
+    if not text.strip():
+        return ""
+    resp = get_http_session().post(f"{_HF_API_BASE}/Helsinki-NLP/opus-mt-{src_lang}-{tgt_lang}",
+                                   json={"inputs": text}, timeout=30)
+    resp.raise_for_status()
+    out = resp.json()
+    if isinstance(out, list) and out:
+        return out[0].get("translation_text", "")
+    return ""
+
+def read_docx(file):
+    """Paragraph text from a .docx upload; docx imports lazily so cold start never pays for it."""
+    import docx
+    return "\n".join(p.text for p in docx.Document(file).paragraphs)
+
+def read_pdf(file):
+    """Page text from a PDF upload; PyPDF2 imports lazily so cold start never pays for it."""
+    import PyPDF2
+    return "\n".join((page.extract_text() or "") for page in PyPDF2.PdfReader(file).pages)
+
+# Sentence boundaries for chunking; covers the Arabic question mark for en<->ar work.
+_SENT_SPLIT = re.compile(r"(?<=[.!?؟])\s+")
+
+def _chunk_text(text, width=500):
+    """Greedily pack whole sentences into API-sized pieces of up to ~width chars.
+
+    Mid-sentence splits both degrade opus-mt output and produce uneven
+    payloads the server pads to the longest; packing sentences keeps chunks
+    full and intact. Only a single sentence longer than width still gets
+    hard-wrapped.
+    """
+    sentences = [s for s in _SENT_SPLIT.split(text) if s.strip()]
+    chunks = []
+    current, size = [], 0
+    for sent in sentences:
+        if size and size + len(sent) > width:
+            chunks.append(" ".join(current))
+            current, size = [], 0
+        if len(sent) > width:
+            chunks.extend(textwrap.wrap(sent, width))
+        else:
+            current.append(sent)
+            size += len(sent) + 1
+    if current:
+        chunks.append(" ".join(current))
+    return chunks or [""]
+
+@st.cache_resource
+def _trans_cache():
+    """Chunk-translation cache shared by all sessions; cache_resource survives reruns."""
+    return {}
+
+def translate_long_text(text, src_lang="en", tgt_lang="ar", batch_size=16):
+    """Translate a long document, sending chunks as batched list payloads.
+
+    The opus-mt endpoint accepts a list of inputs and batches server-side, so
+    an N-chunk document costs ceil(N/batch_size) round-trips instead of N,
+    and the batched calls go out concurrently so their network latencies
+    overlap. A failed batch falls back to per-chunk calls so one bad chunk
+    cannot sink the whole document. Chunks seen before come straight from
+    the process-wide cache, so re-rendering a document costs no API calls.
+    """
+    chunks = _chunk_text(text)
+    cache = _trans_cache()
+    key = (src_lang, tgt_lang)
+    pending = [c for c in dict.fromkeys(chunks) if (key, c) not in cache]
+    url = f"{_HF_API_BASE}/Helsinki-NLP/opus-mt-{src_lang}-{tgt_lang}"
+
+    def _translate_batch(batch):
+        try:
+            resp = get_http_session().post(url, json={"inputs": batch}, timeout=60)
+            resp.raise_for_status()
+            return [item.get("translation_text", "") for item in resp.json()]
+        except Exception:
+            results = []
+            for chunk in batch:
+                try:
+                    results.append(translate_text(chunk, src_lang, tgt_lang))
+                except Exception:
+                    results.append("[ERROR: Translation failed]")
+            return results
+
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    if len(batches) == 1:
+        out = _translate_batch(batches[0])
+    elif batches:
+        # map() preserves batch order, so the document reassembles correctly.
+        with ThreadPoolExecutor(max_workers=min(8, len(batches))) as pool:
+            out = [t for translated in pool.map(_translate_batch, batches) for t in translated]
+    else:
+        out = []
+    for chunk, translated in zip(pending, out):
+        if translated != "[ERROR: Translation failed]":
+            cache[(key, chunk)] = translated
+    while len(cache) > 4_000:  # FIFO eviction past 4k chunks
+        del cache[next(iter(cache))]
+    failed = dict(zip(pending, out))
+    return " ".join(cache.get((key, c), failed.get(c, "")) for c in chunks)
+
+# Metric objects are built once; sentence_score reuses their internal tokenizers.
+_BLEU = BLEU(effective_order=True)
+_BLEU_CORPUS = BLEU()
+_CHRF = CHRF()
+_TER = TER()
+
+# Format strings per opcode tag: {s} is the student slice, {r} the reference slice.
+_TAG_FMT = {
+    "equal": "<span style='color:green'>{s}</span> ",
+    "replace": "<span style='color:red'>{s}</span> ",
+    "insert": "<span style='color:orange'>{s}</span> ",
+    "delete": "<span style='color:blue'>{r}</span> ",
+}
+_FB_FMT = {
+    "replace": "Replace '{s}' with '{r}'",
+    "insert": "Extra words: '{s}'",
+    "delete": "Missing words: '{r}'",
+}
+
+@functools.lru_cache(maxsize=4096)
+def _tokens(text):
+    """Split once per distinct text; repeated diffs and metrics reuse the tuple."""
+    return tuple(text.split())
+
+@functools.lru_cache(maxsize=1024)
+def _diff_opcodes(student, reference):
+    """Word-level diff opcodes for a pair, built once and shared across renders."""
+    stu = _tokens(student)
+    ref = _tokens(reference)
+    if RAPIDFUZZ_AVAILABLE:
+        return rf_levenshtein.opcodes(ref, stu).as_list()
+    return SequenceMatcher(None, ref, stu, autojunk=False).get_opcodes()
+
+# Inflection suffixes that usually signal a grammar slip rather than a word choice.
+_SUFFIX = re.compile(r"(?:ed|ing)$")
+
+@st.cache_data(max_entries=512)
+def categorize_errors(student, reference):
+    """Bucket words the student used that are absent from the reference.
+
+    Counter subtraction finds the residual words in one C-level multiset
+    difference (a word used twice but referenced once still surfaces); the
+    compiled suffix regex and a length check then split them into grammar
+    suspects, long-word choices, and other lexical picks.
+    """
+    diff = set(Counter(student.lower().split()) - Counter(reference.lower().split()))
+    grammar = sorted(w for w in diff if _SUFFIX.search(w))
+    rest = diff.difference(grammar)
+    long_words = sorted(w for w in rest if len(w) > 8)
+    lexical = sorted(rest.difference(long_words))
+    return {"grammar": grammar, "long_words": long_words, "lexical": lexical}
+
+def compute_fluency(text):
+    """Crude fluency proxy from whitespace tokens: 1.0 when the average word length sits near 5."""
+    words = text.split()
+    if not words:
+        return 0.0
+    avg_len = sum(map(len, words)) / len(words)
+    return round(max(0.0, min(1.0, 1.0 - abs(avg_len - 5.0) / 10.0)), 3)
+
+def unigram_jaccard(a, b):
+    """Cheap lexical-overlap prefilter used to dodge transformer passes on obvious mismatches."""
+    sa, sb = set(_tokens(a)), set(_tokens(b))
+    return len(sa & sb) / max(1, len(sa | sb))
+
+def estimate_keystrokes(original, edited):
+    """Constant-memory proxy for editing effort: edit distance from the MT output."""
+    if original == edited:
+        return 0
+    if RAPIDFUZZ_AVAILABLE:
+        return rf_levenshtein.distance(original, edited)
+    matcher = SequenceMatcher(None, original, edited, autojunk=False)
+    return sum(max(i2 - i1, j2 - j1)
+               for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal")
+
+@st.cache_data(max_entries=512)
+def highlight_diff(student, reference):
+    """Return an HTML word-level diff of the student edit against the reference, plus feedback notes."""
+    stu = _tokens(student)
+    ref = _tokens(reference)
+    if stu == ref:
+        highlighted = " ".join(f"<span style='color:green'>{w}</span>" for w in stu)
+        return highlighted, []
+
+    parts = []
+    feedback = []
+    for tag, i1, i2, j1, j2 in _diff_opcodes(student, reference):
+        stu_words = " ".join(stu[j1:j2])
+        ref_words = " ".join(ref[i1:i2])
+        parts.append(_TAG_FMT[tag].format(s=stu_words, r=ref_words))
+        if tag != "equal":
+            feedback.append(_FB_FMT[tag].format(s=stu_words, r=ref_words))
+    return "".join(parts), feedback
+
+@st.cache_resource
+def get_scoring_pool():
+    """Single worker that runs the BERT forward pass while sacrebleu metrics run on the caller."""
+    return ThreadPoolExecutor(max_workers=1)
+
+def compute_scores_batch(pairs):
+    """Score a list of (hypothesis, reference) pairs, batching BERTScore into one model call."""
+    # Normalize None up front so a missing reference can never reach the metrics
+    # (scoring a hypothesis against itself burns a transformer pass for a trivial 1.0).
+    pairs = [(hyp or "", ref or "") for hyp, ref in pairs]
+    results = [None] * len(pairs)
+    needs_metrics = []
+    for i, (hypothesis, reference) in enumerate(pairs):
+        if not reference.strip():
+            results[i] = {"BLEU": None, "chrF": None, "TER": None, "BERT_F1": None}
+        elif not hypothesis.strip():
+            # Empty edit: canonical worst scores, no need to run any metric.
+            results[i] = {"BLEU": 0.0, "chrF": 0.0, "TER": 100.0, "BERT_F1": 0.0}
+        elif hypothesis == reference:
+            # Exact match: canonical best scores, skip the transformer entirely.
+            results[i] = {"BLEU": 100.0, "chrF": 100.0, "TER": 0.0, "BERT_F1": 1.0}
+        else:
+            needs_metrics.append(i)
+
+    # Kick off the transformer pass first so it overlaps the CPU-side metrics.
+    # Near-disjoint pairs get a canonical 0.0 instead of burning a forward pass;
+    # without bert-score installed nothing gets scored, so everything stays None
+    # rather than faking a 0.0 for pairs that merely failed the prefilter.
+    needs_bert = []
+    bert_skipped = set()
+    if BERT_AVAILABLE:
+        for i in needs_metrics:
+            if unigram_jaccard(pairs[i][0], pairs[i][1]) < 0.05:
+                bert_skipped.add(i)
+            else:
+                needs_bert.append(i)
+    future = None
+    unique_pairs = {}
+    if BERT_AVAILABLE and needs_bert:
+        # Classes produce many identical edits of the same reference; score each
+        # distinct pair once and fan the result back out.
+        for i in needs_bert:
+            unique_pairs.setdefault(pairs[i], []).append(i)
+        distinct = list(unique_pairs)
+        future = get_scoring_pool().submit(score_many,
+                                           [h for h, r in distinct],
+                                           [r for h, r in distinct])
+
+    for i in needs_metrics:
+        hypothesis, reference = pairs[i]
+        results[i] = {
+            "BLEU": _BLEU.sentence_score(hypothesis, [reference]).score,
+            "chrF": _CHRF.sentence_score(hypothesis, [reference]).score,
+            "TER": _TER.sentence_score(hypothesis, [reference]).score,
+            "BERT_F1": 0.0 if i in bert_skipped else None,
+        }
+
+    if future is not None:
+        try:
+            P, R, F1 = future.result()
+            for indexes, f1 in zip(unique_pairs.values(), F1.tolist()):
+                for i in indexes:
+                    results[i]["BERT_F1"] = float(f1)
+        except Exception:
+            pass
+
+    return results
+
+@st.cache_data
+def cohort_corpus_scores(cands, refs):
+    """Class-level corpus scores in a single sacrebleu pass over all submissions."""
+    return {
+        "BLEU": _BLEU_CORPUS.corpus_score(list(cands), [list(refs)]).score,
+        "chrF": _CHRF.corpus_score(list(cands), [list(refs)]).score,
+        "TER": _TER.corpus_score(list(cands), [list(refs)]).score,
+    }
+
+@st.cache_data(max_entries=4096, show_spinner=False)
+def _score_pair(hypothesis, reference):
+    """Memoized single-pair scoring; st.cache_data survives the per-rerun module reset."""
+    scores = compute_scores_batch([(hypothesis, reference)])[0]
+    return (scores["BLEU"], scores["chrF"], scores["TER"], scores["BERT_F1"])
+
+def compute_scores(hypothesis, reference):
+    """Compute BLEU, chrF, TER, and optionally BERTScore."""
+    bleu, chrf, ter, bert_f1 = _score_pair(hypothesis, reference)
+    return {"BLEU": bleu, "chrF": chrf, "TER": ter, "BERT_F1": bert_f1}
+
+def csv_export_bytes(df, flush_bytes=65536):
+    """Serialize a frame to CSV bytes in bounded chunks.
+
+    csv.writer streams rows through a small reusable buffer instead of
+    materializing the whole export twice (df.to_csv's giant str plus its
+    encoded copy); peak extra memory is one flush_bytes buffer.
+    """
+    def _chunks():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(df.columns)
+        for row in df.itertuples(index=False):
+            writer.writerow(row)
+            if buf.tell() > flush_bytes:
+                yield buf.getvalue().encode("utf-8")
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue().encode("utf-8")
+    return b"".join(_chunks())
+
+def _fragment(func):
+    """Scope reruns to the decorated block when this Streamlit has fragments."""
+    return st.fragment(func) if hasattr(st, "fragment") else func
+
+@_fragment
+def render_submissions_dashboard():
+    st.subheader("Student Submissions")
+    df = load_submissions(table_fingerprint("editing_submissions"))
+
+    unscored = df[df["bert_f1"].isna() & df["reference"].fillna("").str.strip().astype(bool)]
+    if BERT_AVAILABLE and not unscored.empty:
+        if st.button(f"Score batch ({len(unscored)} submissions missing BERT F1)"):
+            rescored = compute_scores_batch(list(zip(unscored["student_edit"], unscored["reference"])))
+            conn = get_conn()
+            with conn:
+                # int() unwraps numpy.int64 ids, which sqlite3 refuses to bind.
+                conn.executemany("UPDATE editing_submissions SET bert_f1 = ? WHERE id = ?",
+                                 [(s["BERT_F1"], int(i)) for s, i in zip(rescored, unscored["id"])])
+            # UPDATEs don't move the (COUNT, MAX(id)) fingerprint, so drop the
+            # cached frame explicitly or the new scores would never display.
+            load_submissions.clear()
+            st.success("✅ Batch scoring complete!")
+            df = load_submissions(table_fingerprint("editing_submissions"))
+
+    uncomet = df[df["comet"].isna() & df["reference"].fillna("").str.strip().astype(bool)]
+    if COMET_AVAILABLE and not uncomet.empty:
+        if st.button(f"Rescore with COMET ({len(uncomet)} submissions)"):
+            # One batched predict over every pending triplet instead of N single calls.
+            scores = comet_scores(uncomet["source"].fillna("").tolist(),
+                                  uncomet["student_edit"].fillna("").tolist(),
+                                  uncomet["reference"].tolist())
+            if scores is not None:
+                conn = get_conn()
+                with conn:
+                    # int() unwraps numpy.int64 ids, which sqlite3 refuses to bind.
+                    conn.executemany("UPDATE editing_submissions SET comet = ? WHERE id = ?",
+                                     [(float(s), int(i)) for s, i in zip(scores, uncomet["id"])])
+                # UPDATEs don't move the fingerprint; drop the cached frame so the
+                # scores show up and a second click can't redo the COMET batch.
+                load_submissions.clear()
+                st.success("✅ COMET rescoring complete!")
+                df = load_submissions(table_fingerprint("editing_submissions"))
+            else:
+                st.error("⚠️ COMET scoring failed.")
+
+    if not df.empty:
+        counts = (df["student_name"].value_counts()
+                  .rename_axis("Student").reset_index(name="Submissions"))
+        st.markdown("**Submissions per student**")
+        st.table(counts.head(10))
+
+        refd = df[df["reference"].fillna("").str.strip().astype(bool)]
+        if not refd.empty:
+            cohort = cohort_corpus_scores(tuple(refd["student_edit"].fillna("")),
+                                          tuple(refd["reference"]))
+            st.markdown(f"**Class corpus scores** — BLEU: {cohort['BLEU']:.2f} | "
+                        f"chrF: {cohort['chrF']:.2f} | TER: {cohort['TER']:.2f}")
+
+            all_errors = []
+            for edit, ref in zip(refd["student_edit"].fillna(""), refd["reference"]):
+                all_errors.extend(highlight_diff(edit, ref)[1])
+            if all_errors:
+                fb_df = pd.DataFrame(Counter(all_errors).most_common(10),
+                                     columns=["Feedback", "Count"])
+                st.markdown("**Most common edit feedback**")
+                st.bar_chart(fb_df.set_index("Feedback")["Count"])
+                st.table(fb_df)
+
+        st.markdown("**🏆 Leaderboard (total BLEU points)**")
+        st.table(load_leaderboard(table_fingerprint("editing_submissions")))
+
+        if RAPIDFUZZ_AVAILABLE and len(df) > 1:
+            with st.expander("🔍 Submission similarity check"):
+                edits = df["student_edit"].fillna("").tolist()
+                names = df["student_name"].fillna("").tolist()
+                # Full N x N matrix in one C call, parallelized across cores.
+                sims = rf_process.cdist(edits, edits,
+                                        scorer=rf_levenshtein.normalized_similarity,
+                                        workers=-1)
+                suspicious = [(names[i], names[j], round(float(sims[i][j]), 3))
+                              for i in range(len(edits))
+                              for j in range(i + 1, len(edits))
+                              if names[i] != names[j] and sims[i][j] >= 0.9]
+                if suspicious:
+                    st.table(pd.DataFrame(suspicious,
+                                          columns=["Student A", "Student B", "Similarity"]))
+                else:
+                    st.write("No highly similar submissions between different students.")
+        st.download_button("⬇️ Download Submissions CSV", csv_export_bytes(df),
+                           file_name="submissions.csv", mime="text/csv")
+        st.markdown("---")
+
+    for r in df.itertuples():
+        st.markdown(f"""
+**Student:** {r.student_name}  
+**Submitted At:** {r.submitted_at}  
+**Source:** {r.source}  
+**MT Output:** {r.mt_output}  
+**Student Edit:** {r.student_edit}  
+**Reference:** {r.reference}  
+
+📊 **Scores**  
+- BLEU: {r.bleu}  
+- chrF: {r.chrf}  
+- TER: {r.ter}  
+- BERT F1: {r.bert_f1}  
+- COMET: {r.comet}  
+
+⌛ **Time Spent:** {r.time_spent} sec  
+⌨️ **Keystrokes:** {r.keystrokes}  
+""")
+        st.markdown("---")
+
+# ============ APP ============
+st.sidebar.title("Navigation")
+role = st.sidebar.selectbox("I am a", ["Student", "Instructor"])
+
+if role == "Instructor":
+    st.title("📚 Instructor Dashboard")
+    menu = st.sidebar.radio("Choose Action", ["Create Editing Exercise", "View Submissions"])
+
+    if menu == "Create Editing Exercise":
+        st.subheader("Create a New Editing Exercise")
+        uploaded = st.file_uploader("Upload a source document (optional)",
+                                    type=["txt", "docx", "pdf"])
+        source_default = ""
+        if uploaded is not None:
+            try:
+                if uploaded.name.endswith(".docx"):
+                    source_default = read_docx(uploaded)
+                elif uploaded.name.endswith(".pdf"):
+                    source_default = read_pdf(uploaded)
+                else:
+                    source_default = uploaded.getvalue().decode("utf-8", "replace")
+            except Exception:
+                st.error("⚠️ Could not read the uploaded file.")
+        source = st.text_area("Source Text", value=source_default)
+        mt_output = st.text_area("Machine Translation Output")
+        if st.button("🤖 Suggest MT Output (Helsinki-NLP en→ar)"):
+            try:
+                st.session_state.mt_suggestion = (translate_long_text(source)
+                                                  if len(source) > 500 else translate_text(source))
+            except Exception:
+                st.error("⚠️ Translation service unavailable. Paste the MT output manually.")
+        if st.session_state.get("mt_suggestion"):
+            st.text_area("Suggested MT Output (copy into the field above)",
+                         st.session_state.mt_suggestion)
+        reference = st.text_area("Reference Translation (optional)")
+        idioms = st.text_input("Idioms / collocations to look for (comma-separated, optional)")
+        instructor = st.text_input("Instructor Name")
+        if st.button("Save Exercise"):
+            conn = get_conn()
+            with conn:
+                conn.execute(_INSERT_EXERCISE, (source, mt_output, reference, idioms, instructor))
+            st.success("✅ Exercise created successfully!")
+
+    elif menu == "View Submissions":
+        render_submissions_dashboard()
+
+elif role == "Student":
+    st.title("✍️ Student Editing Exercise")
+    student = st.text_input("Enter your name")
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute("SELECT id, source, mt_output, reference, idioms FROM editing_exercises ORDER BY created_at DESC")
+    exercises = c.fetchall()
+
+    if not exercises:
+        st.warning("⚠️ No exercises available yet. Please wait for your instructor.")
+    else:
+        choice = st.selectbox("Choose an Exercise", [f"Exercise {e[0]}" for e in exercises])
+        selected = exercises[int(choice.split()[1]) - 1]
+        st.markdown(f"**Source Text:** {selected[1]}")
+        st.markdown(f"**Machine Translation Output:** {selected[2]}")
+        reference = selected[3]
+
+        # Start the clock when this exercise is first shown, not on every rerun.
+        if st.session_state.get("timed_exercise") != selected[0]:
+            st.session_state.timed_exercise = selected[0]
+            st.session_state.exercise_start = time.perf_counter()
+        student_edit = st.text_area("Edit the Translation Here ✍️", value=selected[2])
+        keystrokes = estimate_keystrokes(selected[2], student_edit)
+
+        if st.button("Submit"):
+            time_spent = round(time.perf_counter() - st.session_state.exercise_start, 2)
+            scores = evaluate_with_semantic_cache(student_edit, reference or "")
+
+            st.session_state.setdefault("pending_subs", []).append(
+                (selected[0], student, student_edit, time_spent, keystrokes,
+                 scores.get("BLEU"), scores.get("chrF"), scores.get("TER"), scores.get("BERT_F1")))
+            conn = get_conn()
+            with conn:
+                conn.executemany(_INSERT_SUBMISSION, st.session_state.pending_subs)
+            st.session_state.pending_subs = []
+
+            if ST_AVAILABLE and reference and reference.strip():
+                sem = semantic_score(student_edit, reference)
+                if sem is not None:
+                    scores["Semantic"] = round(sem, 4)
+
+            if COMET_AVAILABLE and reference and reference.strip():
+                comet = comet_scores([selected[1]], [student_edit], [reference])
+                if comet:
+                    scores["COMET"] = round(float(comet[0]), 4)
+
+            scores["Fluency"] = compute_fluency(student_edit)
+            st.success("✅ Submission saved and evaluated!")
+            st.json(scores)
+
+            if reference and reference.strip():
+                highlighted, feedback = highlight_diff(student_edit, reference)
+                st.markdown("**Your edit vs. reference:**")
+                st.markdown(highlighted, unsafe_allow_html=True)
+                for note in feedback:
+                    st.info(note)
+
+                buckets = categorize_errors(student_edit, reference)
+                if buckets["grammar"]:
+                    st.warning(f"📝 Check verb forms: {', '.join(buckets['grammar'])}")
+                if buckets["long_words"]:
+                    st.info(f"📖 Long word choices not in the reference: {', '.join(buckets['long_words'])}")
+
+            found, missing = check_idioms(student_edit, selected[4] or "")
+            if found:
+                st.success(f"💡 Idioms used: {', '.join(found)}")
+            if missing:
+                st.warning(f"💡 Idioms to consider: {', '.join(missing)}")